@@ -1,10 +1,14 @@
 import os
+import sys
+import threading
+from queue import Queue as ThreadQueue
+from time import monotonic
 from uuid import uuid4
 import logging
-from functools import wraps, partial
+from functools import partial
 
 from kombu import Queue, Connection, Exchange
-from kombu.pools import producers
+from kombu.pools import connections, producers
 from kombu.common import send_reply
 from amqp import exceptions
 
@@ -12,33 +16,139 @@ from .settings import CONN_DICT
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# Use orjson for (de)serialising message bodies when it is available.
+# Registering it for application/json also makes kombu decode incoming
+# json bodies with it. Falls back to the stdlib json serializer.
+try:
+    import orjson
+    from kombu.serialization import register
+
+    register('orjson',
+             orjson.dumps,
+             orjson.loads,
+             content_type='application/json',
+             content_encoding='utf-8')
+    REPLY_SERIALIZER = 'orjson'
+except ImportError:
+    REPLY_SERIALIZER = 'json'
+
 class Qurator(object):
 
     """Manage Queue and callbacks for a set of Consumers"""
 
-    queues = {}
-    callbacks = {}
-    dispatch = {}
+    __slots__ = ('conn_dict', 'queues', 'callbacks', 'dispatch',
+                 'prefetch_count',
+                 '_exchange', '_task_exchange', '_prefix', '_prefix_dot',
+                 '_queue',
+                 '_conn', '_lock', '_reply_q', '_reply_thread',
+                 '_send_reply', '_partials')
 
     def __init__(self,
                  queue=None,
                  prefix='qurator',
                  exchange=Exchange(),
                  task_exchange=Exchange(),
-                 conn_dict=CONN_DICT):
+                 conn_dict=CONN_DICT,
+                 prefetch_count=None):
         """Constructor
 
         :prefix: Prefix for consumer queues. Defaults to 'qurator'.
         :queue: Default name for queue
         :exchange: Exchange to use.
+        :prefetch_count: number of unacked messages the broker may keep
+        in flight per consumer. Set it to at least batch_size when
+        using batched tasks.
         """
-        self.conn_dict = CONN_DICT
+        self.conn_dict = conn_dict
+        self.queues = {}
+        self.callbacks = {}
+        self.dispatch = {}
         self._exchange = exchange
         self._task_exchange = task_exchange
         self._prefix = prefix
+        self._prefix_dot = (prefix or '') + '.'
         self._queue = queue
+        self.prefetch_count = prefetch_count
+        # Unopened connection template; kombu's pools hand out real,
+        # pre-opened connections keyed on it.
+        self._conn = Connection(**conn_dict)
+        self._lock = threading.Lock()
+        self._reply_q = None
+        self._reply_thread = None
+        # Reply exchange is fixed for the instance; pre-bind it so the
+        # hot reply path makes a single pre-packed call.
+        self._send_reply = partial(send_reply, self._exchange)
+        self._partials = {}
         logger.debug("Initialised Qurator class")
 
+    def _decorator_partial(self, method, **kwargs):
+        """Return a cached partial for a parameterized decorator call.
+
+        ``@q.rpc(queue_name='x')`` builds a partial per invocation;
+        callers that iterate routes hit the same arguments repeatedly,
+        so the partials are cached per method and arguments.
+
+        :method: bound decorator method (self.rpc or self.task)
+        :kwargs: decorator keyword arguments
+        :returns: partial of ``method`` with ``kwargs`` bound
+
+        """
+        key = (method.__name__,) + tuple(sorted(kwargs.items()))
+        cached = self._partials.get(key)
+        if cached is None:
+            cached = partial(method, **kwargs)
+            self._partials[key] = cached
+        return cached
+
+    def close(self):
+        """Close any pooled connections opened for replies."""
+        connections[self._conn].force_close_all()
+
+    def _reply_loop(self):
+        """Publish queued RPC replies from the background thread."""
+        while True:
+            message, response, queue_name = self._reply_q.get()
+            try:
+                self.respond_to_client(message, response, queue_name)
+            except Exception:
+                logger.error("Unable to reply to request", exc_info=True)
+            finally:
+                self._reply_q.task_done()
+
+    def _enqueue_reply(self, message, response, queue_name):
+        """Hand a reply off to the background publisher thread.
+
+        Publishing inline would block the consumer loop on the reply
+        round-trip, so replies are queued and sent from a single
+        daemon thread that holds its own producer. The thread is
+        started lazily on the first reply.
+
+        :message: Message object being replied to
+        :response: datastructure that needs to go back to client
+        :queue_name: name of queue
+        """
+        if self._reply_thread is None:
+            with self._lock:
+                if self._reply_thread is None:
+                    self._reply_q = ThreadQueue()
+                    thread = threading.Thread(target=self._reply_loop,
+                                              daemon=True)
+                    thread.start()
+                    self._reply_thread = thread
+        self._reply_q.put((message, response, queue_name))
+
+    def queues_list(self, name):
+        """Return the queue registered under ``name`` as a list.
+
+        Kept for callers that still expect the old list-valued
+        ``queues`` layout.
+
+        :name: name of registered function
+        :returns: one-element list with the Queue
+
+        """
+        return [self.queues[name]]
+
     def _error(self, error, message):
         """Return an error if caller sent an unknown command.
 
@@ -60,16 +170,20 @@ class Qurator(object):
         """
 
         name = function.__name__.lower()
-        if name not in self.queues:
-            self.queues[name] = []
-        if name not in self.callbacks:
-            self.callbacks[name] = []
-        self.callbacks[name].append(callback)
+        if self.queues.get(name) is not None:
+            # Already registered (e.g. a module reload); keep the
+            # existing queue rather than building a duplicate.
+            self.callbacks[name] = callback
+            return function
+        self.callbacks[name] = callback
         # If not set by instance, make same as function name.
         if queue_name is None:
-            queue_name = '.'.join([self._prefix, name])
+            queue_name = self._prefix_dot + name
+        # Interned routing keys hit the identity fast path in the
+        # dict probes on the dispatch side.
+        queue_name = sys.intern(queue_name)
 
-        logger.debug("Setting up %s" % queue_name)
+        logger.debug("Setting up %s", queue_name)
         routing_key = queue_name
         # Create the queue.
         exchange = self._exchange
@@ -81,37 +195,90 @@ class Qurator(object):
                       durable=exchange.durable,
                       routing_key=routing_key)
 
-        self.queues[name].append(queue)
-        # The function returned by the decorator don't really do
-        # anything.  The process_msg callback added to the consumer
-        # is what actually responds to messages  from the client
-        # on this particular queue.
+        self.queues[name] = queue
+        # Return the function untouched.  The process_msg callback
+        # added to the consumer is what actually responds to messages
+        # from the client on this particular queue, but the function
+        # itself stays directly callable.
+        return function
+
+    def _batch_callback(self, func, batch_size, batch_timeout):
+        """Build a message callback that acks a whole batch at once.
+
+        Bodies are buffered until ``batch_size`` messages have arrived
+        or ``batch_timeout`` seconds have passed since the first
+        buffered message, then ``func`` is called with the list of
+        bodies and the last message is ack'ed with ``multiple=True``,
+        covering the batch with a single AMQP frame. The consumer's
+        prefetch count should be at least ``batch_size`` so the broker
+        keeps the whole batch in flight.
 
-        def decorate(func):
-            @wraps(func)
-            def wrapper(*args, **kwargs):
-                pass
-            return wrapper
-        return decorate
+        :func: wrapped function; receives a list of bodies
+        :batch_size: number of messages per batch
+        :batch_timeout: seconds before a partial batch is flushed
+        :returns: message callback
 
-    def task(self, func=None, *, queue_name=None):
+        """
+        buffer = []
+        deadline = [0.0]
+
+        def process_message(body, message):
+            if not buffer:
+                deadline[0] = monotonic() + batch_timeout
+            buffer.append((body, message))
+            if len(buffer) < batch_size and monotonic() < deadline[0]:
+                return
+            batch = buffer[:]
+            del buffer[:]
+            try:
+                func([b for b, _ in batch])
+            except Exception:
+                logger.error("Problem processing task batch", exc_info=True)
+            else:
+                logger.debug("Ack'ing batch of %d messages.", len(batch))
+                batch[-1][1].ack(multiple=True)
+
+        return process_message
+
+    def task(self, func=None, *, queue_name=None, batch_size=1,
+             batch_timeout=0.1):
         """Wrap around a function that should be a task.
         The client should not expect anything to be returned.
 
+        :batch_size: when greater than 1, buffer this many messages and
+        call the wrapped function with a list of bodies, ack'ing the
+        batch with a single multiple-ack frame.
+        :batch_timeout: seconds before a partial batch is flushed.
         """
         if not self._task_exchange.durable:
             raise Exception('Task exchange should be durable.')
         if func is None:
-            return partial(self.task, queue_name=queue_name)
+            return self._decorator_partial(self.task,
+                                           queue_name=queue_name,
+                                           batch_size=batch_size,
+                                           batch_timeout=batch_timeout)
 
-        def process_message(body, message):
-            logger.debug("Processing function {!r} "
-                         " in message: {!r} "
-                         "with data {!r}".format(func.__name__,
-                                                 message,
-                                                 body))
+        if batch_size > 1:
+            return self._wrap_function(
+                func,
+                self._batch_callback(func, batch_size, batch_timeout),
+                queue_name,
+                task=True)
+
+        # Hot names are bound as default arguments so the callback
+        # loads them as locals instead of closure cells per message.
+        def process_message(body, message,
+                            _func=func,
+                            _func_name=func.__name__):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Processing function %r "
+                             " in message: %r "
+                             "with data %r",
+                             _func_name,
+                             message,
+                             body)
             try:
-                func(body)
+                _func(body)
             except Exception:
                 logger.error("Problem processing task", exc_info=True)
             else:
@@ -131,11 +298,17 @@ class Qurator(object):
 
         """
         if func is None:
-            return partial(self.rpc, queue_name=queue_name)
+            return self._decorator_partial(self.rpc, queue_name=queue_name)
 
-        def process_message(body, message):
-            logger.debug("Processing function {!r} "
-                         "with data {!r}".format(func.__name__, body))
+        # Hot names are bound as default arguments so the callback
+        # loads them as locals instead of closure cells per message.
+        def process_message(body, message,
+                            _func=func,
+                            _func_name=func.__name__,
+                            _enqueue_reply=self._enqueue_reply):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Processing function %r "
+                             "with data %r", _func_name, body)
             try:
                 properties = message.properties
                 correlation_id = properties.setdefault( 'correlation_id', uuid4().hex)
@@ -143,11 +316,11 @@ class Qurator(object):
                                                                    correlation_id))
             except Exception:
                 logger.error("No correlation id for request!"
-                             " {!r}".format(body),
+                             " %r", body,
                              exc_info=True)
-            response = func(body)
-            logger.debug("Wrapped method returned:  {!r}".format(response))
-            self.respond_to_client(message, response, queue_name)
+            response = _func(body)
+            logger.debug("Wrapped method returned:  %r", response)
+            _enqueue_reply(message, response, queue_name)
             message.ack()
 
         return self._wrap_function(func, process_message, queue_name)
@@ -161,38 +334,44 @@ class Qurator(object):
             response = {}
         if queue_name is None:
             queue_name = __name__
-        logger.debug("Replying to queue {!r} with properties: {!r}".format(
-            message.properties['reply_to'],
-            message.properties['correlation_id']
-        ))
-        with Connection(**CONN_DICT) as conn:
-            with producers[conn].acquire(block=True) as producer:
-                try:
-                    send_reply(
-                        self._exchange,
-                        message,
-                        response,
-                        producer,
-                        retry=True,
-                        retry_policy={
-                            'max_retries': 3,
-                            'interval_start': 0,
-                            'interval_step': 0.2,
-                            'interval_max': 0.2,
-                        }
-                    )
-                except exceptions.AMQPError:
-                    logger.error("Problem communicating with rabbit",
-                                 exc_info=True)
-                except KeyError:
-                    logger.error('Missing key in request', exc_info=True)
-                except Exception:
-                    logger.error('Unable to reply to request', exc_info=True)
-                else:
-                    correlation_id = message.properties['correlation_id']
-                    logger.info('STOPSERVICE:%s;CORRELATION_ID:%s' % (
-                        __name__, correlation_id))
-                    logger.debug('Replied with response {!r}'.format(response))
+        # Bail out before acquiring a connection; a malformed request
+        # should not cost a handshake.
+        properties = getattr(message, 'properties', None) or {}
+        reply_to = properties.get('reply_to')
+        if reply_to is None:
+            logger.error('No reply_to in request: %r', properties)
+            return
+        logger.debug("Replying to queue %r with properties: %r",
+                     reply_to,
+                     properties.get('correlation_id'))
+        with connections[self._conn].acquire(block=True) as conn, \
+                producers[conn].acquire(block=True) as producer:
+            try:
+                self._send_reply(
+                    message,
+                    response,
+                    producer,
+                    serializer=REPLY_SERIALIZER,
+                    retry=True,
+                    retry_policy={
+                        'max_retries': 3,
+                        'interval_start': 0,
+                        'interval_step': 0.2,
+                        'interval_max': 0.2,
+                    }
+                )
+            except exceptions.AMQPError:
+                logger.error("Problem communicating with rabbit",
+                             exc_info=True)
+            except KeyError:
+                logger.error('Missing key in request', exc_info=True)
+            except Exception:
+                logger.error('Unable to reply to request', exc_info=True)
+            else:
+                correlation_id = message.properties['correlation_id']
+                logger.info('STOPSERVICE:%s;CORRELATION_ID:%s' % (
+                    __name__, correlation_id))
+                logger.debug('Replied with response %r', response)
 
     def run(self):
         from .worker import Worker
@@ -205,3 +384,33 @@ class Qurator(object):
                 worker.run()
             except KeyboardInterrupt:
                 print('bye bye')
+
+    def run_workers(self, workers=2):
+        """Fork worker processes that consume over separate connections.
+
+        A single consumer connection tops out well below what the
+        broker can deliver, so the registered queues are declared once
+        in the parent and then each forked child runs its own worker
+        with its own connection and socket. Call this before any
+        replies have been published so no open connection is shared
+        across the fork.
+
+        :workers: number of worker processes to fork
+        """
+        with Connection(**self.conn_dict) as conn:
+            conn.connect()
+            for queue in self.queues.values():
+                queue(conn).declare()
+        pids = []
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                # Child process: consume until interrupted and exit
+                # without running the parent's cleanup.
+                try:
+                    self.run()
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
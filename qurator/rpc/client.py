@@ -74,19 +74,19 @@ class RpcClient(object):
     def ack_message(self, body, message):
         logger.info("Processing message: {!r} with body {!r}".format(message,
                                                                      body))
-        if 'correlation_id' in message.properties:
-            corr_id = message.properties['correlation_id']
-            try:
-                self.messages.pop(corr_id)
-                server_queue = self.corr_id_server_queue.pop(corr_id)
-                logger.info(
-                    "STOPREQUEST:%s;CORRELATION_ID:%s" %
-                    (server_queue, corr_id))
-                self.reply = body
-                message.ack()
-            except KeyError as e:
-                logger.exception(e)
-                logger.error("Malformed message: {!r}".format(body))
+        corr_id = message.properties.get('correlation_id')
+        if corr_id is None:
+            return
+        pending = self.messages.pop(corr_id, None)
+        server_queue = self.corr_id_server_queue.pop(corr_id, None)
+        if pending is None or server_queue is None:
+            logger.error("Malformed message: {!r}".format(body))
+            return
+        logger.info(
+            "STOPREQUEST:%s;CORRELATION_ID:%s" %
+            (server_queue, corr_id))
+        self.reply = body
+        message.ack()
 
     def _setup_payload(self, command_name, data):
         """Setup the datastructure for either hase-like or standard.
@@ -1,4 +1,4 @@
-from unittest.mock import MagicMock, ANY
+from unittest.mock import MagicMock, ANY, patch
 from kombu import Consumer, Queue
 from kombu.utils import nested
 
@@ -49,7 +49,7 @@ class TestAbstractMQ(TestRabbitpy):
             pass
 
         self.assertIn('moffa', consumer.queues)
-        moffa_queues = consumer.queues['moffa']
+        moffa_queues = consumer.queues_list('moffa')
         self.assertEqual(len(moffa_queues),
                          1,
                          'One consumer')
@@ -62,45 +62,57 @@ class TestAbstractMQ(TestRabbitpy):
             pass
 
         self.assertIn('boffa', consumer.queues)
-        boffa_queues = consumer.queues['boffa']
-        boffa_queue = boffa_queues[0]
+        boffa_queue = consumer.queues['boffa']
         self.assertEqual(boffa_queue.name,
                          'boffa.moffa',
                          'Can specify queue name')
 
-    def test_standard_rpc(self):
-        """Check behaviour of wrapped function."""
-
-        self.pre_declare_queues(['qurator.blah', 'blah.client'])
+    def test_decorated_function_callable(self):
+        """Decorated functions remain directly callable."""
         consumer = Qurator(exchange=self._exchange)
-        checkit = MagicMock(return_value={"msg": "Got reply"})
-        # Now mock it!
-        consumer.respond_to_client = MagicMock()
 
         @consumer.rpc
-        def blah(*args, **kwargs):
-            return checkit(*args, **kwargs)
+        def hoffa(msg):
+            return {"result": msg}
 
-        payload = {"msg": "Hello"}
+        self.assertEqual(hoffa('x'), {"result": 'x'})
 
-        # Send message to server
-        client = RpcClient(exchange=self._exchange, prefix='qurator')
-        reply = client.rpc('blah', payload)
-
-        # Synthetically drain events from queues
-        blah_queues = consumer.queues['blah']
-        blah_callbacks = consumer.callbacks['blah']
-        conn = self._connection
-        with Consumer(conn, blah_queues, callbacks=blah_callbacks):
-            conn.drain_events(timeout=1)
+    def test_standard_rpc(self):
+        """Check behaviour of wrapped function."""
 
-        checkit.assert_called_with(payload)
-        # response = client.retrieve_messages()
-        consumer.respond_to_client.assert_called_with(
-            ANY,
-            {"msg": "Got reply"},
-            None
-        )
+        self.pre_declare_queues(['qurator.blah', 'blah.client'])
+        consumer = Qurator(exchange=self._exchange)
+        checkit = MagicMock(return_value={"msg": "Got reply"})
+        # Now mock it!  Qurator uses __slots__, so patch the class.
+        with patch.object(Qurator, 'respond_to_client') as respond:
+
+            @consumer.rpc
+            def blah(*args, **kwargs):
+                return checkit(*args, **kwargs)
+
+            payload = {"msg": "Hello"}
+
+            # Send message to server
+            client = RpcClient(exchange=self._exchange, prefix='qurator')
+            reply = client.rpc('blah', payload)
+
+            # Synthetically drain events from queues
+            blah_queues = consumer.queues_list('blah')
+            blah_callbacks = [consumer.callbacks['blah']]
+            conn = self._connection
+            with Consumer(conn, blah_queues, callbacks=blah_callbacks):
+                conn.drain_events(timeout=1)
+
+            checkit.assert_called_with(payload)
+            # Replies are published from a background thread; wait until
+            # the queued reply has been processed before asserting.
+            consumer._reply_q.join()
+            # response = client.retrieve_messages()
+            respond.assert_called_with(
+                ANY,
+                {"msg": "Got reply"},
+                None
+            )
 
     def test_rpc_client(self):
         """Check behaviour of client """
@@ -114,8 +126,8 @@ class TestAbstractMQ(TestRabbitpy):
         payload = {"msg": "Boooya"}
         client = RpcClient(exchange=self._exchange, prefix='qurator')
         client.rpc('booya', payload)
-        booya_queue = consumer.queues['booya']
-        booya_callbacks = consumer.callbacks['booya']
+        booya_queue = consumer.queues_list('booya')
+        booya_callbacks = [consumer.callbacks['booya']]
 
         conn = self._connection
         with Consumer(conn, booya_queue, callbacks=booya_callbacks):
@@ -148,8 +160,8 @@ class TestAbstractMQ(TestRabbitpy):
                    request,
                    server_routing_key='qurator.testing_default_exchange')
 
-        queues = q.queues['testing_default_exchange']
-        test_callbacks = q.callbacks['testing_default_exchange']
+        queues = q.queues_list('testing_default_exchange')
+        test_callbacks = [q.callbacks['testing_default_exchange']]
         conn = self._connection
         with Consumer(conn, queues, callbacks=test_callbacks):
             conn.drain_events(timeout=1)
@@ -168,6 +180,26 @@ class TestAbstractMQ(TestRabbitpy):
             def amation(data):
                 return None
 
+    def test_task_batching(self):
+        """Batched tasks ack once per batch."""
+        from kombu import Exchange
+        e = Exchange('', type='direct')
+        q = Qurator(task_exchange=e)
+        collected = []
+
+        @q.task(queue_name='test.task.batch', batch_size=3)
+        def batchit(bodies):
+            collected.append(bodies)
+
+        callback = q.callbacks['batchit']
+        messages = [MagicMock() for _ in range(3)]
+        for i, message in enumerate(messages):
+            callback({'x': i}, message)
+
+        self.assertEqual(collected, [[{'x': 0}, {'x': 1}, {'x': 2}]])
+        messages[-1].ack.assert_called_with(multiple=True)
+        messages[0].ack.assert_not_called()
+
     def test_task_fail(self):
         """What happens when a task fails.
         Expected behaviour is that it does not ack and is left in the queue.
@@ -197,14 +229,13 @@ class TestAbstractMQ(TestRabbitpy):
         client = RpcClient(exchange=e)
         client.task('fail', {'x': 1}, server_routing_key='test.task.fail')
 
-        curr_queues = q.queues['fail']
-        curr_callbacks = q.callbacks['fail']
+        curr_queues = q.queues_list('fail')
 
         def still_around(body, message):
             self.assertFalse(message.acknowledged)
             message.ack()
 
-        curr_callbacks.append(still_around)
+        curr_callbacks = [q.callbacks['fail'], still_around]
 
         with Consumer(self._connection, curr_queues, callbacks=curr_callbacks):
             self._connection.drain_events(timeout=1)
@@ -240,7 +271,7 @@ class TestAbstractMQ(TestRabbitpy):
                     {'x': 1},
                     server_routing_key='test.task.succeed')
 
-        curr_queues = q.queues['succeed']
+        curr_queues = q.queues_list('succeed')
 
         @q.rpc
         def still_around(body, message):
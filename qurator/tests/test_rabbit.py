@@ -75,8 +75,8 @@ class TestRabbitpy(TestCase):
                             "Please provide either both queues and callbacks "
                             "or a command to check")
         if queues is None:
-            queues = qurator.queues[command]
+            queues = qurator.queues_list(command)
         if callbacks is None:
-            callbacks = qurator.callbacks[command]
+            callbacks = [qurator.callbacks[command]]
         with Consumer(self._connection, queues, callbacks=callbacks):
             self._connection.drain_events(timeout=1)
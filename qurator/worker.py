@@ -33,11 +33,15 @@ class Worker(ConsumerMixin):
         """
         consumer_set = []
         logger.info("called get_consumers with {!r}".format(self.consumer.queues))
-        for i in self.consumer.queues.keys():
-            queues = self.consumer.queues[i]
-            callbacks = self.consumer.callbacks[i]
-            logger.debug("Queues: {!r}".format(queues))
-            c = Consumer(queues, callbacks=callbacks)
+        prefetch_count = getattr(self.consumer, 'prefetch_count', None)
+        for name, queue in self.consumer.queues.items():
+            callback = self.consumer.callbacks[name]
+            logger.debug("Queue: {!r}".format(queue))
+            c = Consumer([queue], callbacks=[callback])
+            if prefetch_count:
+                # Let the broker pipeline deliveries instead of
+                # waiting for each ack before sending the next one.
+                c.qos(prefetch_count=prefetch_count)
             consumer_set.append(c)
             logger.info("Added consumer: {!r}".format(c))
 